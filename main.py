@@ -2,11 +2,13 @@
 FastAPI Backend for AI Chatbot with Memory and Personality
 """
 
+import asyncio
+import orjson # type: ignore
 import uvicorn # type: ignore
 from typing import List, Dict, Optional
 from pydantic import BaseModel # type: ignore
 from fastapi import FastAPI, HTTPException  # type: ignore
-from fastapi.responses import FileResponse # type: ignore
+from fastapi.responses import FileResponse, StreamingResponse # type: ignore
 from fastapi.staticfiles import StaticFiles # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
 
@@ -36,6 +38,27 @@ memory_extractor = MemoryExtractor()
 personality_engine = PersonalityEngine()
 vector_memory_store = VectorMemoryStore()
 
+# Count of extractions that found nothing and so skipped the store write
+empty_store_skips = 0
+
+def should_store(memory: ExtractedMemory) -> bool:
+    """Return whether an extraction has anything to store, counting skips"""
+    global empty_store_skips
+    if memory.is_empty():
+        empty_store_skips += 1
+        print(f"Skipped storing empty memory ({empty_store_skips} skipped so far)")
+        return False
+    return True
+
+# Memory updates left running after a streaming client disconnects
+background_tasks = set()
+
+def finish_background_task(task: asyncio.Task) -> None:
+    """Release a finished background task and log its failure, if any"""
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background memory update failed: {task.exception()}")
+
 # Request/Response models
 class Message(BaseModel):
     role: str
@@ -83,16 +106,18 @@ async def get_personalities():
 async def extract_memory(request: MemoryExtractionRequest):
     """Extract memory from messages and store in vector database"""
     try:
-        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
-        memory = memory_extractor.extract_memory(messages)
-        
-        # Store in vector database
-        conversation_context = " ".join([msg.get("content", "") for msg in messages[-5:]])
-        vector_memory_store.store_memory(
-            user_name=request.user_name,
-            memory=memory,
-            conversation_context=conversation_context
-        )
+        messages = request.messages
+        memory = await asyncio.to_thread(memory_extractor.extract_memory, messages)
+        
+        # Store in vector database, skipping empty extractions
+        if should_store(memory):
+            conversation_context = " ".join([msg.content for msg in messages[-5:]])
+            await asyncio.to_thread(
+                vector_memory_store.store_memory,
+                user_name=request.user_name,
+                memory=memory,
+                conversation_context=conversation_context
+            )
         
         return {
             "preferences": [p.model_dump() for p in memory.preferences],
@@ -103,36 +128,39 @@ async def extract_memory(request: MemoryExtractionRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/chat")
+@app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Generate chat response with personality and vector memory retrieval"""
     try:
-        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        messages = request.messages
         user_name = request.user_name or "default_user"
         
         # Retrieve existing memories from vector database
-        existing_memory = vector_memory_store.retrieve_memories(
+        existing_memory = await asyncio.to_thread(
+            vector_memory_store.retrieve_memories,
             user_name=user_name,
             n_results=15
         )
         
         # Extract memory from recent messages (last 30)
         recent_messages = messages[-30:] if len(messages) > 30 else messages
-        new_memory = memory_extractor.extract_memory(recent_messages)
+        new_memory = await asyncio.to_thread(memory_extractor.extract_memory, recent_messages)
         
         # Merge existing and new memories
         merged_memory = vector_memory_store.merge_memories(existing_memory, new_memory)
         
-        # Store the new memory in vector database
-        conversation_context = " ".join([msg.get("content", "") for msg in recent_messages[-5:]])
-        vector_memory_store.store_memory(
-            user_name=user_name,
-            memory=new_memory,
-            conversation_context=conversation_context
-        )
+        # Store the new memory in vector database, skipping empty extractions
+        if should_store(new_memory):
+            conversation_context = " ".join([msg.content for msg in recent_messages[-5:]])
+            await asyncio.to_thread(
+                vector_memory_store.store_memory,
+                user_name=user_name,
+                memory=new_memory,
+                conversation_context=conversation_context
+            )
         
         # Generate response with personality using merged memory
-        response = personality_engine.generate_response(
+        response = await personality_engine.agenerate_response(
             messages,
             request.personality,
             merged_memory
@@ -149,27 +177,95 @@ async def chat(request: ChatRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/compare-personalities")
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Stream chat response chunks as server-sent events, followed by the merged memory"""
+    try:
+        messages = request.messages
+        user_name = request.user_name or "default_user"
+        
+        # Retrieve existing memories from vector database
+        existing_memory = await asyncio.to_thread(
+            vector_memory_store.retrieve_memories,
+            user_name=user_name,
+            n_results=15
+        )
+        
+        recent_messages = messages[-30:] if len(messages) > 30 else messages
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def remember() -> ExtractedMemory:
+        """Extract and store memory from the recent messages, returning it merged with the existing memory"""
+        new_memory = await asyncio.to_thread(memory_extractor.extract_memory, recent_messages)
+        merged_memory = vector_memory_store.merge_memories(existing_memory, new_memory)
+        
+        # Store the new memory in vector database, skipping empty extractions
+        if should_store(new_memory):
+            conversation_context = " ".join([msg.content for msg in recent_messages[-5:]])
+            await asyncio.to_thread(
+                vector_memory_store.store_memory,
+                user_name=user_name,
+                memory=new_memory,
+                conversation_context=conversation_context
+            )
+        
+        return merged_memory
+    
+    # Extract memory in the background so it doesn't delay the first token
+    remembering = asyncio.create_task(remember())
+    
+    async def events():
+        try:
+            # Generate response with personality using the stored memory
+            async for text in personality_engine.generate_response_stream(
+                messages,
+                request.personality,
+                existing_memory
+            ):
+                yield f"data: {orjson.dumps({'text': text}).decode()}\n\n"
+            
+            try:
+                # Shielded so a disconnect here doesn't cancel the memory update
+                merged_memory = await asyncio.shield(remembering)
+                memory = {
+                    "preferences": [p.model_dump() for p in merged_memory.preferences],
+                    "emotional_patterns": [e.model_dump() for e in merged_memory.emotional_patterns],
+                    "facts": [f.model_dump() for f in merged_memory.facts]
+                }
+                yield f"event: memory\ndata: {orjson.dumps(memory).decode()}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {orjson.dumps({'detail': str(e)}).decode()}\n\n"
+        finally:
+            # If the client left mid-stream the memory update keeps running;
+            # hold a reference until it finishes and log any failure
+            background_tasks.add(remembering)
+            remembering.add_done_callback(finish_background_task)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/api/compare-personalities", response_model=ComparisonResponse)
 async def compare_personalities(request: ComparisonRequest):
     """Compare responses across different personalities"""
     try:
-        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        messages = request.messages
         user_name = request.user_name or "default_user"
         
         
         # Retrieve from vector database
-        existing_memory = vector_memory_store.retrieve_memories(
+        existing_memory = await asyncio.to_thread(
+            vector_memory_store.retrieve_memories,
             user_name=user_name,
             n_results=15
         )
         
         # Also extract from recent messages and merge
         recent_messages = messages[-30:] if len(messages) > 30 else messages
-        new_memory = memory_extractor.extract_memory(recent_messages)
+        new_memory = await asyncio.to_thread(memory_extractor.extract_memory, recent_messages)
         memory = vector_memory_store.merge_memories(existing_memory, new_memory)
         
         # Generate comparisons
-        comparisons = personality_engine.compare_responses(messages, memory)
+        comparisons = await personality_engine.compare_responses(messages, memory)
         
         return ComparisonResponse(
             comparisons=comparisons,
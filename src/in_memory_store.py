@@ -5,7 +5,7 @@ This module provides an in-memory alternative to VectorMemoryStore
 for serverless deployments where persistent storage isn't available.
 """
 
-from src.memory_extractor import ExtractedMemory
+from src.memory_extractor import ExtractedMemory, _index_by_merge_key
 
 
 class InMemoryStore:
@@ -27,6 +27,10 @@ class InMemoryStore:
             user_name: Name of the user
             memory: ExtractedMemory object to store
         """
+        # Nothing to merge for an empty extraction
+        if memory.is_empty():
+            return
+        
         # Get existing memory or create empty one
         existing = self._memories.get(user_name, ExtractedMemory(
             preferences=[],
@@ -77,49 +81,46 @@ class InMemoryStore:
             Merged ExtractedMemory
         """
         # Merge preferences (avoid duplicates based on category and preference)
-        existing_prefs = {(p.category, p.preference.lower()) for p in existing.preferences}
         merged_prefs = existing.preferences.copy()
+        pref_index = _index_by_merge_key(merged_prefs)
         for pref in new.preferences:
-            key = (pref.category, pref.preference.lower())
-            if key not in existing_prefs:
+            key = pref.merge_key
+            idx = pref_index.get(key)
+            if idx is None:
+                pref_index[key] = len(merged_prefs)
                 merged_prefs.append(pref)
-            else:
+            elif pref.confidence > merged_prefs[idx].confidence:
                 # Update confidence if new one is higher
-                for i, ep in enumerate(merged_prefs):
-                    if (ep.category, ep.preference.lower()) == key:
-                        if pref.confidence > ep.confidence:
-                            merged_prefs[i] = pref
-                        break
+                merged_prefs[idx] = pref
         
         # Merge emotional patterns (avoid duplicates based on emotion and context)
-        existing_emotions = {(e.emotion.lower(), e.context.lower()) for e in existing.emotional_patterns}
         merged_emotions = existing.emotional_patterns.copy()
+        emotion_index = _index_by_merge_key(merged_emotions)
         for emotion in new.emotional_patterns:
-            key = (emotion.emotion.lower(), emotion.context.lower())
-            if key not in existing_emotions:
+            key = emotion.merge_key
+            idx = emotion_index.get(key)
+            if idx is None:
+                emotion_index[key] = len(merged_emotions)
                 merged_emotions.append(emotion)
             else:
                 # Update frequency
-                for i, ee in enumerate(merged_emotions):
-                    if (ee.emotion.lower(), ee.context.lower()) == key:
-                        merged_emotions[i].frequency += emotion.frequency
-                        break
+                merged_emotions[idx].frequency += emotion.frequency
         
         # Merge facts (avoid duplicates based on fact text)
-        existing_facts = {f.fact.lower() for f in existing.facts}
         merged_facts = existing.facts.copy()
+        fact_index = _index_by_merge_key(merged_facts)
         for fact in new.facts:
-            if fact.fact.lower() not in existing_facts:
+            key = fact.merge_key
+            idx = fact_index.get(key)
+            if idx is None:
+                fact_index[key] = len(merged_facts)
                 merged_facts.append(fact)
-            else:
+            elif fact.importance > merged_facts[idx].importance:
                 # Update importance if new one is higher
-                for i, ef in enumerate(merged_facts):
-                    if ef.fact.lower() == fact.fact.lower():
-                        if fact.importance > ef.importance:
-                            merged_facts[i] = fact
-                        break
+                merged_facts[idx] = fact
         
-        return ExtractedMemory(
+        # Items are already validated, so skip re-validation
+        return ExtractedMemory.model_construct(
             preferences=merged_prefs,
             emotional_patterns=merged_emotions,
             facts=merged_facts
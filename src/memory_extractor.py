@@ -7,12 +7,40 @@ This module extracts and structures user information from chat messages:
 - Facts worth remembering
 """
 
+import io
 import re
-import json
-from typing import List, Dict
+import orjson # type: ignore
+from functools import cached_property
+from typing import List, Dict, Sequence, Union
 from pydantic import BaseModel # type: ignore
 
 from src.models import load_model
+from src.query_cache import QueryCache
+
+# Messages may be plain dicts or request models with role/content attributes
+ChatMessage = Union[Dict[str, str], BaseModel]
+
+# Fallback for fences the fast path misses (e.g. ``` or ```JSON)
+_JSON_FENCE_RE = re.compile(r"```(?:json)?(.*?)```", flags=re.S | re.I)
+
+
+def get_message_field(msg: ChatMessage, field: str) -> str:
+    """Read a field from a message given as a dict or an object with attributes"""
+    if isinstance(msg, dict):
+        return msg.get(field, "")
+    return getattr(msg, field, "")
+
+
+def _index_by_merge_key(items: Sequence) -> Dict[str, int]:
+    """
+    Map each merge_key to the position of its item.
+    
+    The first occurrence wins, matching a front-to-back scan for duplicates.
+    """
+    index = {}
+    for i, item in enumerate(items):
+        index.setdefault(item.merge_key, i)
+    return index
 
 
 class UserPreference(BaseModel):
@@ -21,6 +49,16 @@ class UserPreference(BaseModel):
     preference: str
     confidence: float  # 0.0 to 1.0
 
+    @cached_property
+    def preference_lower(self) -> str:
+        """Lowercased preference used as a merge key"""
+        return self.preference.lower()
+
+    @cached_property
+    def merge_key(self) -> str:
+        """Single-string dedup key (category and lowercased preference)"""
+        return f"{self.category}\x00{self.preference_lower}"
+
 class EmotionalPattern(BaseModel):
     """Represents an emotional pattern"""
     emotion: str
@@ -28,6 +66,21 @@ class EmotionalPattern(BaseModel):
     frequency: int
     triggers: List[str]
 
+    @cached_property
+    def emotion_lower(self) -> str:
+        """Lowercased emotion used as a merge key"""
+        return self.emotion.lower()
+
+    @cached_property
+    def context_lower(self) -> str:
+        """Lowercased context used as a merge key"""
+        return self.context.lower()
+
+    @cached_property
+    def merge_key(self) -> str:
+        """Single-string dedup key (lowercased emotion and context)"""
+        return f"{self.emotion_lower}\x00{self.context_lower}"
+
 class Fact(BaseModel):
     """Represents a fact worth remembering"""
     fact: str
@@ -35,25 +88,40 @@ class Fact(BaseModel):
     importance: float  # 0.0 to 1.0
     context: str
 
+    @cached_property
+    def fact_lower(self) -> str:
+        """Lowercased fact used as a merge key"""
+        return self.fact.lower()
+
+    @cached_property
+    def merge_key(self) -> str:
+        """Single-string dedup key (lowercased fact text)"""
+        return self.fact_lower
+
 class ExtractedMemory(BaseModel):
     """Complete memory extraction result"""
     preferences: List[UserPreference]
     emotional_patterns: List[EmotionalPattern]
     facts: List[Fact]
 
+    def is_empty(self) -> bool:
+        """Whether no preferences, emotional patterns, or facts were extracted"""
+        return not (self.preferences or self.emotional_patterns or self.facts)
+
 class MemoryExtractor:
     """Extracts structured memory from chat messages"""
     
     def __init__(self, api_key: str = None):
         self.client = load_model()
         self.model = "gemini-2.5-flash"
+        self.cache = QueryCache(maxsize=512, ttl=300.0)
     
-    def extract_memory(self, messages: List[Dict[str, str]]) -> ExtractedMemory:
+    def extract_memory(self, messages: Sequence[ChatMessage]) -> ExtractedMemory:
         """
         Extract memory from a list of chat messages.
         
         Args:
-            messages: List of message dicts with 'role' and 'content' keys
+            messages: Messages with 'role' and 'content' (dicts or request models)
             
         Returns:
             ExtractedMemory object with preferences, emotional patterns, and facts
@@ -62,6 +130,19 @@ class MemoryExtractor:
         # Prepare the conversation context
         conversation_text = self._format_conversation(messages)
         
+        # Return a copy of the cached result for an identical conversation, or
+        # for one where only assistant turns changed (user-derived memory
+        # can't change without a new user turn)
+        cache_key = QueryCache.make_key(self.model, conversation_text)
+        user_cache_key = QueryCache.make_key(
+            self.model,
+            "user_turns",
+            *[get_message_field(msg, "content") for msg in messages if get_message_field(msg, "role") == "user"]
+        )
+        cached = self.cache.get(cache_key) or self.cache.get(user_cache_key)
+        if cached is not None:
+            return cached.model_copy(deep=True)
+        
         # Create extraction prompt
         extraction_prompt = f"""Analyze the following conversation and extract structured information about the user.
 
@@ -109,12 +190,17 @@ Be thorough and extract all relevant information. If a category is empty, return
             
             result = self.extract_json_from_llm(response.text)
             
-            # Parse into Pydantic models
-            return ExtractedMemory(
-                preferences=[UserPreference(**p) for p in result.get("preferences", [])],
-                emotional_patterns=[EmotionalPattern(**e) for e in result.get("emotional_patterns", [])],
-                facts=[Fact(**f) for f in result.get("facts", [])]
-            )
+            # Parse into Pydantic models (validated in a single pydantic-core pass)
+            memory = ExtractedMemory.model_validate({
+                "preferences": result.get("preferences", []),
+                "emotional_patterns": result.get("emotional_patterns", []),
+                "facts": result.get("facts", [])
+            })
+            
+            cached = memory.model_copy(deep=True)
+            self.cache.set(cache_key, cached)
+            self.cache.set(user_cache_key, cached)
+            return memory
             
         except Exception as e:
             print(f"Error in memory extraction: {e}")
@@ -125,53 +211,89 @@ Be thorough and extract all relevant information. If a category is empty, return
                 facts=[]
             )
     
-    def _format_conversation(self, messages: List[Dict[str, str]]) -> str:
-        """Format messages into a readable conversation string"""
+    def _format_conversation(self, messages: Sequence[ChatMessage]) -> str:
+        """
+        Format messages into a readable conversation string.
+        
+        Only user turns carry facts about the user, so each user turn is kept
+        with just the assistant turn right before it for context. Repeated
+        user turns are dropped to save prompt tokens.
+        """
         formatted = []
-        for msg in messages:
-            role = msg.get("role", "unknown")
-            content = msg.get("content", "")
-            formatted.append(f"{role.upper()}: {content}")
+        seen_user_turns = set()
+        for i, msg in enumerate(messages):
+            if get_message_field(msg, "role") != "user":
+                continue
+            
+            content = get_message_field(msg, "content")
+            normalized = " ".join(content.lower().split())
+            if normalized in seen_user_turns:
+                continue
+            seen_user_turns.add(normalized)
+            
+            previous = messages[i - 1] if i > 0 else None
+            previous_role = get_message_field(previous, "role") if previous is not None else "user"
+            if previous_role != "user":
+                formatted.append(f"{(previous_role or 'unknown').upper()}: {get_message_field(previous, 'content')}")
+            formatted.append(f"USER: {content}")
         return "\n".join(formatted)
     
     def get_memory_summary(self, memory: ExtractedMemory) -> str:
         """Generate a human-readable summary of extracted memory"""
-        summary_parts = []
+        buf = io.StringIO()
         
         if memory.preferences:
-            summary_parts.append("PREFERENCES:")
+            buf.write("PREFERENCES:\n")
             for pref in memory.preferences:
-                summary_parts.append(f"  - {pref.category}: {pref.preference} (confidence: {pref.confidence:.2f})")
+                buf.write(f"  - {pref.category}: {pref.preference} (confidence: {pref.confidence:.2f})\n")
         
         if memory.emotional_patterns:
-            summary_parts.append("\nEMOTIONAL PATTERNS:")
+            buf.write("\nEMOTIONAL PATTERNS:\n")
             for pattern in memory.emotional_patterns:
-                summary_parts.append(f"  - {pattern.emotion}: {pattern.context} (frequency: {pattern.frequency})")
+                buf.write(f"  - {pattern.emotion}: {pattern.context} (frequency: {pattern.frequency})\n")
                 if pattern.triggers:
-                    summary_parts.append(f"    Triggers: {', '.join(pattern.triggers)}")
+                    buf.write(f"    Triggers: {', '.join(pattern.triggers)}\n")
         
         if memory.facts:
-            summary_parts.append("\nFACTS:")
+            buf.write("\nFACTS:\n")
             for fact in memory.facts:
-                summary_parts.append(f"  - {fact.fact} ({fact.category}, importance: {fact.importance:.2f})")
+                buf.write(f"  - {fact.fact} ({fact.category}, importance: {fact.importance:.2f})\n")
         
-        return "\n".join(summary_parts) if summary_parts else "No memory extracted yet."
+        # Drop the trailing newline
+        summary = buf.getvalue()
+        return summary[:-1] if summary else "No memory extracted yet."
 
-    def extract_json_from_llm(self, text: str) -> dict | None:
+    @staticmethod
+    def extract_json_from_llm(text: str) -> dict | None:
         """
         Extracts and returns JSON data from an LLM response.
-        The LLM should return JSON inside ```json ... ``` blocks.
+        The LLM should return JSON inside ```json ... ``` blocks, but bare
+        JSON and other fenced blocks are accepted too.
         """
         try:
+            text = text.strip()
+            
+            # Bare JSON without any fence
+            if text.startswith("{"):
+                try:
+                    return orjson.loads(text)
+                except orjson.JSONDecodeError:
+                    pass
+            
             # Find the content inside ```json ... ```
-            match = re.search(r"```json(.*?)```", text, flags=re.S)
+            start = text.find("```json")
+            if start >= 0:
+                start += len("```json")
+                end = text.find("```", start)
+                if end >= 0:
+                    return orjson.loads(text[start:end].strip())
+            
+            # Fall back to any fenced block
+            match = _JSON_FENCE_RE.search(text)
             if not match:
                 return None
             
-            json_str = match.group(1).strip()
-
-            # Parse JSON
-            return json.loads(json_str)
+            return orjson.loads(match.group(1).strip())
         
         except Exception as e:
             print("JSON parse error:", e)
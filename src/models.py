@@ -1,13 +1,29 @@
 # src/models.py
 import os
+from functools import lru_cache
 
+import httpx # type: ignore
 from google import genai
+from google.genai import types # type: ignore
 from dotenv import load_dotenv # type: ignore
 
+# Shared connection pool settings: HTTP/2 with long-lived keepalive
+# connections so repeated Gemini calls skip the TCP + TLS handshake
+HTTP_CLIENT_ARGS = {
+    "http2": True,
+    "limits": httpx.Limits(
+        max_connections=50,
+        max_keepalive_connections=20,
+        keepalive_expiry=120.0
+    ),
+}
+
+@lru_cache(maxsize=1)
 def load_model():
     """
     Load and configure the Gemini 2.5 Flash model.
-    Returns the configured model instance.
+    Returns the configured model instance, shared process-wide so every
+    caller reuses the same client and connection pool.
     """
     
     # Load .env
@@ -17,7 +33,13 @@ def load_model():
         raise RuntimeError("❌ GEMINI_API_KEY not found in .env")
 
     model = genai.Client(
-        api_key=GEMINI_API_KEY
+        api_key=GEMINI_API_KEY,
+        http_options=types.HttpOptions(
+            timeout=30_000,  # milliseconds
+            client_args=HTTP_CLIENT_ARGS,
+            # An explicit httpx client also stops google-genai from switching
+            # to aiohttp (installed via chromadb), which drops these settings
+            httpx_async_client=httpx.AsyncClient(timeout=30.0, **HTTP_CLIENT_ARGS)
+        )
     )
     return model
-
@@ -7,23 +7,31 @@ This module transforms the agent's reply tone based on selected personality:
 - Therapist-style
 """
 
-from typing import List, Dict, Optional
-from src.memory_extractor import ExtractedMemory
+import math
+import asyncio
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import List, Dict, Optional, AsyncIterator, Sequence
+from src.memory_extractor import (
+    ExtractedMemory, MemoryExtractor, UserPreference, EmotionalPattern, ChatMessage, get_message_field
+)
 
 from src.models import load_model
+from src.query_cache import QueryCache
 
 
+@dataclass(frozen=True, slots=True)
 class Personality:
     """Personality configuration"""
-    def __init__(self, name: str, system_prompt: str, description: str):
-        self.name = name
-        self.system_prompt = system_prompt
-        self.description = description
+    name: str
+    system_prompt: str
+    description: str
 
 class PersonalityEngine:
     """Manages different personality styles for the chatbot"""
     
-    PERSONALITIES = {
+    # Read-only registry, safe to share across threads
+    PERSONALITIES = MappingProxyType({
         "calm_mentor": Personality(
             name="Calm Mentor",
             system_prompt="""You are a calm, wise, and patient mentor. Your communication style is:
@@ -69,12 +77,15 @@ class PersonalityEngine:
             system_prompt="You are a helpful, friendly AI assistant.",
             description="Standard helpful assistant"
         )
-    }
+    })
     
     def __init__(self):
         self.client = load_model()
         self.model = "gemini-2.5-flash"
+        self.embedding_model = "text-embedding-004"
         self.current_personality = "default"
+        self.cache = QueryCache(maxsize=2048, ttl=300.0)
+        self._background_tasks = set()
     
     def set_personality(self, personality_key: str):
         """Set the active personality"""
@@ -90,7 +101,7 @@ class PersonalityEngine:
     
     def generate_response(
         self,
-        messages: List[Dict[str, str]],
+        messages: Sequence[ChatMessage],
         personality_key: str = None,
         memory: Optional[ExtractedMemory] = None
     ) -> str:
@@ -105,26 +116,230 @@ class PersonalityEngine:
         Returns:
             Generated response string
         """
+        if memory:
+            memory = self._rank_memory(memory, get_message_field(messages[-1], "content"))
+        system_prompt = self._build_prompt(messages, personality_key, memory)
+        
+        try:
+            return self._cached_generate(system_prompt)
+            
+        except Exception as e:
+            return f"I apologize, but I encountered an error: {str(e)}"
+    
+    async def agenerate_response(
+        self,
+        messages: Sequence[ChatMessage],
+        personality_key: str = None,
+        memory: Optional[ExtractedMemory] = None
+    ) -> str:
+        """
+        Generate a response with the specified personality using the async client.
+        
+        Args:
+            messages: Conversation history
+            personality_key: Which personality to use
+            memory: Extracted memory to inform the response
+            
+        Returns:
+            Generated response string
+        """
+        if memory:
+            memory = await self._arank_memory(memory, get_message_field(messages[-1], "content"))
+        system_prompt = self._build_prompt(messages, personality_key, memory)
+        
+        try:
+            return await self._acached_generate(system_prompt)
+            
+        except Exception as e:
+            return f"I apologize, but I encountered an error: {str(e)}"
+    
+    async def generate_response_stream(
+        self,
+        messages: Sequence[ChatMessage],
+        personality_key: str = None,
+        memory: Optional[ExtractedMemory] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream a response with the specified personality as text chunks.
+        
+        Args:
+            messages: Conversation history
+            personality_key: Which personality to use
+            memory: Extracted memory to inform the response
+            
+        Yields:
+            Response text chunks as they are generated
+        """
+        if memory:
+            # Only the query is embedded before the first token; memory items
+            # rank with cached vectors and missing ones are embedded in the
+            # background for later turns
+            query = get_message_field(messages[-1], "content")
+            texts = self._pending_embeddings(memory, query)
+            if query in texts:
+                texts.remove(query)
+                await self._aembed([query])
+            self._warm_embeddings(texts)
+            memory = self._apply_ranking(memory, query)
+        system_prompt = self._build_prompt(messages, personality_key, memory)
+        cache_key = QueryCache.make_key(self.model, system_prompt)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        try:
+            chunks = []
+            async for chunk in await self.client.aio.models.generate_content_stream(
+                model=self.model,
+                contents=system_prompt,
+            ):
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+            
+            if chunks:
+                self.cache.set(cache_key, "".join(chunks))
+            
+        except Exception as e:
+            yield f"I apologize, but I encountered an error: {str(e)}"
+    
+    def _build_prompt(
+        self,
+        messages: Sequence[ChatMessage],
+        personality_key: str = None,
+        memory: Optional[ExtractedMemory] = None
+    ) -> str:
+        """Build the system prompt with personality and memory context"""
         personality = self.get_personality(personality_key)
         
-        # Build system prompt with personality and memory context
         system_prompt = personality.system_prompt
-        system_prompt += f"\n\nUser's last message: {messages[-1]['content']}"
+        system_prompt += f"\n\nUser's last message: {get_message_field(messages[-1], 'content')}"
 
         if memory:
             memory_context = self._build_memory_context(memory)
             system_prompt += f"\n\nIMPORTANT CONTEXT ABOUT THE USER:\n{memory_context}\n\nUse this information to personalize your responses while maintaining your personality style."
         
+        return system_prompt
+    
+    def _cached_generate(self, prompt: str) -> str:
+        """Generate content for a prompt, reusing the response for identical prompts"""
+        cache_key = QueryCache.make_key(self.model, prompt)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        response = self.client.models.generate_content(
+            model=self.model,
+            contents=prompt,
+        )
+        
+        if response.text:
+            self.cache.set(cache_key, response.text)
+        return response.text
+    
+    async def _acached_generate(self, prompt: str) -> str:
+        """Async variant of _cached_generate using the client's aio interface"""
+        cache_key = QueryCache.make_key(self.model, prompt)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=prompt,
+        )
+        
+        if response.text:
+            self.cache.set(cache_key, response.text)
+        return response.text
+    
+    def _rank_memory(self, memory: ExtractedMemory, query: str) -> ExtractedMemory:
+        """
+        Order memory items by relevance to the query using embedding similarity.
+        
+        Args:
+            memory: Memory to rank
+            query: Text to rank against (usually the user's last message)
+            
+        Returns:
+            ExtractedMemory with each list sorted by relevance, or the original
+            memory if the query can't be embedded
+        """
+        texts = self._pending_embeddings(memory, query)
+        if texts:
+            try:
+                result = self.client.models.embed_content(
+                    model=self.embedding_model,
+                    contents=texts,
+                )
+                self._cache_embeddings(texts, [e.values for e in result.embeddings])
+            except Exception as e:
+                print(f"Error ranking memory: {e}")
+        
+        return self._apply_ranking(memory, query)
+    
+    async def _arank_memory(self, memory: ExtractedMemory, query: str) -> ExtractedMemory:
+        """Async variant of _rank_memory using the client's aio interface"""
+        await self._aembed(self._pending_embeddings(memory, query))
+        return self._apply_ranking(memory, query)
+    
+    async def _aembed(self, texts: List[str]) -> None:
+        """Embed texts with the aio client and cache their vectors"""
+        if not texts:
+            return
+        
         try:
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=system_prompt,
+            result = await self.client.aio.models.embed_content(
+                model=self.embedding_model,
+                contents=texts,
             )
-            
-            return response.text
-            
+            self._cache_embeddings(texts, [e.values for e in result.embeddings])
         except Exception as e:
-            return f"I apologize, but I encountered an error: {str(e)}"
+            print(f"Error ranking memory: {e}")
+    
+    def _warm_embeddings(self, texts: List[str]) -> None:
+        """Embed texts in a background task so later rankings find them cached"""
+        if not texts:
+            return
+        
+        task = asyncio.create_task(self._aembed(texts))
+        # Keep a reference until done so the task isn't garbage collected
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    def _embedding_key(self, text: str) -> str:
+        """Cache key for the embedding of a text"""
+        return QueryCache.make_key(self.embedding_model, text)
+    
+    def _pending_embeddings(self, memory: ExtractedMemory, query: str) -> List[str]:
+        """Collect the distinct query and memory texts with no cached embedding"""
+        texts = dict.fromkeys([query])
+        for item in (*memory.preferences, *memory.emotional_patterns, *memory.facts):
+            texts[_embedding_text(item)] = None
+        
+        return [text for text in texts if self.cache.get(self._embedding_key(text)) is None]
+    
+    def _cache_embeddings(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """Store fresh embeddings under their text's cache key"""
+        for text, vector in zip(texts, vectors):
+            self.cache.set(self._embedding_key(text), vector)
+    
+    def _apply_ranking(self, memory: ExtractedMemory, query: str) -> ExtractedMemory:
+        """Sort each memory list by similarity to the query using cached embeddings"""
+        query_vector = self.cache.get(self._embedding_key(query))
+        if query_vector is None:
+            return memory
+        
+        def relevance(item) -> float:
+            vector = self.cache.get(self._embedding_key(_embedding_text(item)))
+            return _cosine_similarity(query_vector, vector) if vector else 0.0
+        
+        return ExtractedMemory.model_construct(
+            preferences=sorted(memory.preferences, key=relevance, reverse=True),
+            emotional_patterns=sorted(memory.emotional_patterns, key=relevance, reverse=True),
+            facts=sorted(memory.facts, key=relevance, reverse=True)
+        )
     
     def _build_memory_context(self, memory: ExtractedMemory) -> str:
         """Build a context string from extracted memory"""
@@ -146,21 +361,86 @@ class PersonalityEngine:
         
         return "\n".join(context_parts) if context_parts else "No specific context available yet."
     
-    def compare_responses(
+    async def compare_responses(
         self,
-        messages: List[Dict[str, str]],
+        messages: Sequence[ChatMessage],
         memory: Optional[ExtractedMemory] = None
     ) -> Dict[str, str]:
         """
         Generate responses with different personalities for comparison.
         
+        All personalities are requested in a single Gemini call returning JSON.
+        If that response can't be parsed, the personality calls are issued
+        concurrently instead, bounded by the slowest single response.
+        
         Returns:
             Dictionary mapping personality keys to responses
         """
-        comparisons = {}
+        keys = ["default", "calm_mentor", "witty_friend", "therapist"]
+        
+        # Rank memory once; item and query embeddings are cached for the fallback calls
+        if memory:
+            memory = await self._arank_memory(memory, get_message_field(messages[-1], "content"))
+        
+        batch_prompt = self._build_batch_prompt(messages, keys, memory)
+        cache_key = QueryCache.make_key(self.model, batch_prompt)
+        try:
+            batch_text = self.cache.get(cache_key)
+            if batch_text is None:
+                response = await self.client.aio.models.generate_content(
+                    model=self.model,
+                    contents=batch_prompt,
+                )
+                batch_text = response.text
+            
+            result = MemoryExtractor.extract_json_from_llm(batch_text or "")
+            if result and all(isinstance(result.get(key), str) and result[key] for key in keys):
+                # Only cache replies that parsed, so a bad one isn't replayed
+                self.cache.set(cache_key, batch_text)
+                return {key: result[key] for key in keys}
+        except Exception as e:
+            print(f"Error in batched personality comparison: {e}")
+        
+        responses = await asyncio.gather(
+            *[self.agenerate_response(messages, key, memory) for key in keys]
+        )
         
-        for key in ["default", "calm_mentor", "witty_friend", "therapist"]:
-            comparisons[key] = self.generate_response(messages, key, memory)
+        return dict(zip(keys, responses))
+    
+    def _build_batch_prompt(
+        self,
+        messages: Sequence[ChatMessage],
+        personality_keys: List[str],
+        memory: Optional[ExtractedMemory] = None
+    ) -> str:
+        """Build a single prompt asking for one response per personality as JSON"""
+        prompt = f"User's last message: {get_message_field(messages[-1], 'content')}"
         
-        return comparisons
+        if memory:
+            memory_context = self._build_memory_context(memory)
+            prompt += f"\n\nIMPORTANT CONTEXT ABOUT THE USER:\n{memory_context}\n\nUse this information to personalize each response while maintaining its personality style."
+        
+        prompt += "\n\nReply to the user's last message once in each of the following styles:"
+        for key in personality_keys:
+            prompt += f"\n\n[{key}]\n{self.get_personality(key).system_prompt}"
+        
+        json_keys = ", ".join(f'"{key}": "string"' for key in personality_keys)
+        prompt += f"\n\nReturn the result as a JSON object inside a ```json code block with this exact structure:\n{{{json_keys}}}"
+        
+        return prompt
+
+
+def _embedding_text(item) -> str:
+    """Text embedded for a memory item when ranking it"""
+    if isinstance(item, UserPreference):
+        return f"{item.preference} ({item.category})"
+    if isinstance(item, EmotionalPattern):
+        return f"{item.emotion}: {item.context}"
+    return item.fact
+
 
+def _cosine_similarity(a: List[float], b: List[float]) -> float:
+    """Cosine similarity between two vectors"""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
@@ -0,0 +1,77 @@
+"""
+Query Cache Module
+
+This module provides a small thread-safe LRU cache with TTL expiry used to
+avoid repeating identical Gemini calls for the same conversation.
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class QueryCache:
+    """Thread-safe LRU cache with per-entry time-to-live"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of entries kept before evicting the oldest
+            ttl: Seconds an entry stays valid after being stored
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Build a cache key from one or more strings, ignoring whitespace differences"""
+        normalized = "\0".join(" ".join(part.split()) for part in parts)
+        return hashlib.blake2b(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Return the cached value for a key, or None if missing or expired.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached value or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a value, evicting the least recently used entry if full.
+
+        Args:
+            key: Cache key
+            value: Value to cache
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all cached entries"""
+        with self._lock:
+            self._entries.clear()
@@ -5,8 +5,17 @@ This module handles storing and retrieving user memories in a vector database.
 Memories are stored with user_name for automatic retrieval.
 """
 
+import os
 import time
-import json
+import logging
+import sqlite3
+import queue
+import atexit
+import itertools
+import threading
+from operator import itemgetter
+from typing import Callable, Iterable, Optional
+import orjson # type: ignore
 import chromadb # type: ignore
 from chromadb.config import Settings # type: ignore
 
@@ -14,30 +23,190 @@ from src.memory_extractor import (
     ExtractedMemory,
     UserPreference,
     EmotionalPattern,
-    Fact
+    Fact,
+    _index_by_merge_key
 )
 
+logger = logging.getLogger(__name__)
+
+
+def _json(obj) -> str:
+    """Serialize an object to a JSON string with orjson"""
+    return orjson.dumps(obj).decode()
+
+
+# Records written before flat metadata keep their fields in a JSON "data" blob.
+# Numeric fields are stored natively; older records hold them as strings,
+# which pydantic coerces on construction
+_get_preference_fields = itemgetter("category", "preference", "confidence")
+_get_emotional_pattern_fields = itemgetter("emotion", "context", "frequency", "triggers")
+_get_fact_fields = itemgetter("fact", "category", "importance", "context")
+
+
+def _preference_from_metadata(metadata: dict) -> UserPreference:
+    """Rebuild a UserPreference from stored metadata"""
+    if "data" in metadata:
+        return UserPreference(**orjson.loads(metadata["data"]))
+    category, preference, confidence = _get_preference_fields(metadata)
+    return UserPreference(category=category, preference=preference, confidence=confidence)
+
+
+def _emotional_pattern_from_metadata(metadata: dict) -> EmotionalPattern:
+    """Rebuild an EmotionalPattern from stored metadata"""
+    if "data" in metadata:
+        return EmotionalPattern(**orjson.loads(metadata["data"]))
+    emotion, context, frequency, triggers = _get_emotional_pattern_fields(metadata)
+    return EmotionalPattern(emotion=emotion, context=context, frequency=frequency, triggers=orjson.loads(triggers))
+
+
+def _fact_from_metadata(metadata: dict) -> Fact:
+    """Rebuild a Fact from stored metadata"""
+    if "data" in metadata:
+        return Fact(**orjson.loads(metadata["data"]))
+    fact, category, importance, context = _get_fact_fields(metadata)
+    return Fact(fact=fact, category=category, importance=importance, context=context)
+
 
 class VectorMemoryStore:
     """Manages vector database storage and retrieval of user memories"""
     
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    # Single collection used before memories were split by type
+    LEGACY_COLLECTION = "user_memories"
+    
+    # Attempts made by the background writer before a batch is given up
+    WRITE_ATTEMPTS = 3
+    
+    def __init__(
+        self,
+        persist_directory: str = "./chroma_db",
+        batch_size: int = 250
+    ):
         """
         Initialize the vector memory store.
         
         Args:
             persist_directory: Directory to persist the ChromaDB database
+            batch_size: Maximum number of queued records coalesced into one write
         """
         self.client = chromadb.PersistentClient(
             path=persist_directory,
             settings=Settings(anonymized_telemetry=False)
         )
         
-        # Get or create collection for memories
-        self.collection = self.client.get_or_create_collection(
-            name="user_memories",
+        self._enable_wal(persist_directory)
+        
+        # One collection per memory type, so retrieval needs no type filter
+        self.preferences_collection = self.client.get_or_create_collection(
+            name="preference_memories",
             metadata={"hnsw:space": "cosine"}
         )
+        self.emotions_collection = self.client.get_or_create_collection(
+            name="emotion_memories",
+            metadata={"hnsw:space": "cosine"}
+        )
+        self.facts_collection = self.client.get_or_create_collection(
+            name="fact_memories",
+            metadata={"hnsw:space": "cosine"}
+        )
+        self._collections = {
+            "preference": self.preferences_collection,
+            "emotional_pattern": self.emotions_collection,
+            "fact": self.facts_collection,
+        }
+        self._migrate_legacy_collection()
+        
+        # Record ids come from a thread-safe counter, seeded with the startup
+        # time in microseconds so ids stay unique across restarts
+        self._id_counter = itertools.count(int(time.time() * 1000000))
+        
+        # Writes are queued and applied by a background thread, so callers
+        # never wait on ChromaDB's SQLite commit
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=10_000)
+        self._write_error: Optional[Exception] = None
+        self._writer = threading.Thread(
+            target=self._writer_loop,
+            name="vector-memory-writer",
+            daemon=True
+        )
+        self._writer.start()
+        atexit.register(self.flush)
+    
+    def _enable_wal(self, persist_directory: str) -> None:
+        """
+        Switch ChromaDB's SQLite file to write-ahead logging.
+        
+        WAL with ChromaDB's default synchronous=FULL keeps crash safety while
+        making commits much cheaper. The mode is stored in the database file,
+        so it applies to every connection ChromaDB opens later.
+        
+        Args:
+            persist_directory: Directory holding the ChromaDB database
+        """
+        db_path = os.path.join(persist_directory, "chroma.sqlite3")
+        if not os.path.exists(db_path):
+            return
+        
+        try:
+            conn = sqlite3.connect(db_path)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not enable WAL mode: {e}")
+    
+    def _migrate_legacy_collection(self) -> None:
+        """
+        Move records from the old single collection into the per-type collections.
+        
+        The legacy collection is read and written in pages no larger than
+        ChromaDB's max batch size, and only dropped once every page has been
+        copied. Stored vectors are carried over, since both sides use the same
+        embedding function and space. Pages are upserted, so a migration
+        interrupted part-way is simply resumed on the next startup.
+        """
+        if self.LEGACY_COLLECTION not in [
+            getattr(c, "name", c) for c in self.client.list_collections()
+        ]:
+            return
+        
+        legacy = self.client.get_collection(self.LEGACY_COLLECTION)
+        page_size = self.client.get_max_batch_size()
+        offset = 0
+        while True:
+            results = legacy.get(
+                include=["documents", "metadatas", "embeddings"],
+                limit=page_size,
+                offset=offset
+            )
+            if not results["ids"]:
+                break
+            
+            by_type = {mem_type: ([], [], [], []) for mem_type in self._collections}
+            for doc, metadata, embedding, record_id in zip(
+                results["documents"], results["metadatas"], results["embeddings"], results["ids"]
+            ):
+                buffer = by_type.get((metadata or {}).get("type"))
+                if buffer is None:
+                    continue
+                buffer[0].append(doc)
+                buffer[1].append(metadata)
+                buffer[2].append(embedding)
+                buffer[3].append(record_id)
+            
+            for mem_type, (documents, metadatas, embeddings, ids) in by_type.items():
+                if ids:
+                    self._collections[mem_type].upsert(
+                        documents=documents,
+                        metadatas=metadatas,
+                        embeddings=embeddings,
+                        ids=ids
+                    )
+            
+            offset += len(results["ids"])
+        
+        self.client.delete_collection(self.LEGACY_COLLECTION)
     
     def store_memory(
         self,
@@ -48,76 +217,207 @@ class VectorMemoryStore:
         """
         Store extracted memory in the vector database.
         
+        Records are queued and written by a background thread (see flush).
+        
         Args:
             user_name: Name of the user
             memory: ExtractedMemory object to store
             conversation_context: Optional context from the conversation
         """
-        # Create documents from memory components
-        documents = []
-        metadatas = []
-        ids = []
+        # Nothing to build or queue for an empty extraction
+        if memory.is_empty():
+            return
+        
+        self._queue.put(self._build_records(user_name, memory, conversation_context))
+    
+    def bulk_store(
+        self,
+        memories: Iterable[tuple[str, ExtractedMemory]],
+        batch_size: int = 250,
+        progress: Optional[Callable[[int], None]] = None
+    ) -> int:
+        """
+        Store many memories at once, e.g. when replaying history into a fresh store.
+        
+        Records are written synchronously in chunks of at most batch_size, so
+        HNSW insertion is amortized across many points instead of paid per turn.
+        
+        Args:
+            memories: (user_name, ExtractedMemory) pairs to store
+            batch_size: Maximum number of records written per chunk
+            progress: Optional callback receiving the count of memories processed
+            
+        Returns:
+            Number of records written
+        """
+        # Keep ordering with anything already queued
+        self.flush()
+        
+        pending = {mem_type: [] for mem_type in self._collections}
+        pending_count = 0
+        written = 0
+        
+        for processed, (user_name, memory) in enumerate(memories, start=1):
+            for mem_type, type_records in self._build_records(user_name, memory).items():
+                for record in type_records:
+                    pending[mem_type].append(record)
+                    pending_count += 1
+                    
+                    # Split mid-memory so no chunk exceeds batch_size records
+                    if pending_count == batch_size:
+                        self._write([pending])
+                        written += pending_count
+                        pending = {mem_type: [] for mem_type in self._collections}
+                        pending_count = 0
+            
+            if progress:
+                progress(processed)
+        
+        if pending_count:
+            self._write([pending])
+            written += pending_count
+        
+        return written
+    
+    def _build_records(
+        self,
+        user_name: str,
+        memory: ExtractedMemory,
+        conversation_context: str = ""
+    ) -> dict:
+        """Build (document, metadata, id) records per memory type"""
+        # Bind per-call lookups to locals once instead of per record
+        preferences = memory.preferences
+        emotional_patterns = memory.emotional_patterns
+        facts = memory.facts
+        next_id = self._id_counter.__next__
+        
+        # Context suffixes are the same for every record, so format them once
+        ctx_suffix = f" Context: {conversation_context}" if conversation_context else ""
+        fact_ctx_suffix = f" Additional context: {conversation_context}" if conversation_context else ""
+        
+        # Build (document, metadata, id) records for preferences. Fields are
+        # stored as flat metadata so retrieval needs no JSON decoding
+        records = {}
+        records["preference"] = [
+            (
+                f"User preference: {pref.preference} in category {pref.category}. Confidence: {pref.confidence}{ctx_suffix}",
+                {
+                    "user_name": user_name,
+                    "category": pref.category,
+                    "preference": pref.preference,
+                    "confidence": pref.confidence
+                },
+                f"{user_name}_pref_{next_id()}"
+            )
+            for pref in preferences
+        ]
+        
+        # Emotional patterns
+        records["emotional_pattern"] = [
+            (
+                f"Emotional pattern: {pattern.emotion} in context {pattern.context}. Frequency: {pattern.frequency}"
+                + (f" Triggers: {', '.join(pattern.triggers)}" if pattern.triggers else "")
+                + ctx_suffix,
+                {
+                    "user_name": user_name,
+                    "emotion": pattern.emotion,
+                    "context": pattern.context,
+                    "frequency": pattern.frequency,
+                    "triggers": _json(pattern.triggers)
+                },
+                f"{user_name}_emotion_{next_id()}"
+            )
+            for pattern in emotional_patterns
+        ]
+        
+        # Facts
+        records["fact"] = [
+            (
+                f"Fact about user: {fact.fact} in category {fact.category}. Importance: {fact.importance}"
+                + (f" Context: {fact.context}" if fact.context else "")
+                + fact_ctx_suffix,
+                {
+                    "user_name": user_name,
+                    "fact": fact.fact,
+                    "category": fact.category,
+                    "importance": fact.importance,
+                    "context": fact.context
+                },
+                f"{user_name}_fact_{next_id()}"
+            )
+            for fact in facts
+        ]
+        
+        return records
+    
+    def flush(self) -> None:
+        """
+        Block until every queued record has been written.
         
-        timestamp = int(time.time() * 1000000)  # Microsecond timestamp for uniqueness
+        Raises:
+            RuntimeError: If a queued write failed since the last flush
+        """
+        self._queue.join()
         
-        # Store preferences
-        for idx, pref in enumerate(memory.preferences):
-            doc_text = f"User preference: {pref.preference} in category {pref.category}. Confidence: {pref.confidence}"
-            if conversation_context:
-                doc_text += f" Context: {conversation_context}"
+        error, self._write_error = self._write_error, None
+        if error is not None:
+            raise RuntimeError(f"Failed to write queued memories: {error}") from error
+    
+    def _writer_loop(self) -> None:
+        """Drain the write queue, coalescing queued records into batched adds"""
+        while True:
+            batches = [self._queue.get()]
+            count = sum(len(r) for r in batches[0].values())
             
-            documents.append(doc_text)
-            metadatas.append({
-                "user_name": user_name,
-                "type": "preference",
-                "category": pref.category,
-                "confidence": str(pref.confidence),
-                "data": json.dumps(pref.model_dump())
-            })
-            ids.append(f"{user_name}_pref_{timestamp}_{idx}")
-        
-        # Store emotional patterns
-        for idx, pattern in enumerate(memory.emotional_patterns):
-            doc_text = f"Emotional pattern: {pattern.emotion} in context {pattern.context}. Frequency: {pattern.frequency}"
-            if pattern.triggers:
-                doc_text += f" Triggers: {', '.join(pattern.triggers)}"
-            if conversation_context:
-                doc_text += f" Context: {conversation_context}"
+            # Pick up whatever else is already queued, up to batch_size records
+            while count < self.batch_size:
+                try:
+                    batch = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batches.append(batch)
+                count += sum(len(r) for r in batch.values())
             
-            documents.append(doc_text)
-            metadatas.append({
-                "user_name": user_name,
-                "type": "emotional_pattern",
-                "emotion": pattern.emotion,
-                "frequency": str(pattern.frequency),
-                "data": json.dumps(pattern.model_dump())
-            })
-            ids.append(f"{user_name}_emotion_{timestamp}_{idx}")
-        
-        # Store facts
-        for idx, fact in enumerate(memory.facts):
-            doc_text = f"Fact about user: {fact.fact} in category {fact.category}. Importance: {fact.importance}"
-            if fact.context:
-                doc_text += f" Context: {fact.context}"
-            if conversation_context:
-                doc_text += f" Additional context: {conversation_context}"
+            try:
+                self._write_with_retry(batches)
+            except Exception as e:
+                ids = [record[2] for batch in batches for records in batch.values() for record in records]
+                logger.error(
+                    "Dropped %d memory records after %d failed writes (ids: %s): %s",
+                    len(ids), self.WRITE_ATTEMPTS, ", ".join(ids), e
+                )
+                # Surfaced to the next flush() caller
+                self._write_error = e
+            finally:
+                for _ in batches:
+                    self._queue.task_done()
+    
+    def _write_with_retry(self, batches: list) -> None:
+        """Write batches, retrying with a short backoff before giving up"""
+        for attempt in range(1, self.WRITE_ATTEMPTS + 1):
+            try:
+                self._write(batches)
+                return
+            except Exception as e:
+                if attempt == self.WRITE_ATTEMPTS:
+                    raise
+                logger.warning("Memory write failed (attempt %d), retrying: %s", attempt, e)
+                time.sleep(0.1 * 2 ** attempt)
+    
+    def _write(self, batches: list) -> None:
+        """Write queued records with a single upsert per collection"""
+        for mem_type, collection in self._collections.items():
+            type_records = [record for batch in batches for record in batch[mem_type]]
+            if not type_records:
+                continue
             
-            documents.append(doc_text)
-            metadatas.append({
-                "user_name": user_name,
-                "type": "fact",
-                "category": fact.category,
-                "importance": str(fact.importance),
-                "data": json.dumps(fact.model_dump())
-            })
-            ids.append(f"{user_name}_fact_{timestamp}_{idx}")
-        
-        # Add to collection if we have documents
-        if documents:
-            self.collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
+            documents, metadatas, ids = zip(*type_records)
+            # Upsert so a retried batch doesn't trip over records already written
+            collection.upsert(
+                documents=list(documents),
+                metadatas=list(metadatas),
+                ids=list(ids)
             )
     
     def retrieve_memories(
@@ -126,55 +426,47 @@ class VectorMemoryStore:
         n_results: int = 10
     ) -> ExtractedMemory:
         """
-        Retrieve relevant memories for a user.
+        Retrieve memories for a user.
         
         Args:
             user_name: Name of the user
-            query: Optional query text for semantic search (if None, returns all user memories)
-            n_results: Number of results to return
+            n_results: Number of results to return per memory type
             
         Returns:
             ExtractedMemory object with retrieved memories
         """
-        # Filter by user_name
-        where_filter = {"user_name": user_name}
+        # Make sure queued writes are visible
+        self.flush()
         
-        # Get all memories for user
-        results = self.collection.get(
-            where=where_filter,
-            limit=n_results
+        return ExtractedMemory(
+            preferences=self._load(self.preferences_collection, user_name, n_results, _preference_from_metadata),
+            emotional_patterns=self._load(self.emotions_collection, user_name, n_results, _emotional_pattern_from_metadata),
+            facts=self._load(self.facts_collection, user_name, n_results, _fact_from_metadata)
+        )
+    
+    def _load(self, collection, user_name: str, n_results: int, from_metadata) -> list:
+        """Get a user's records from one collection and rebuild them as models"""
+        # Only metadatas are needed to rebuild the models
+        results = collection.get(
+            where={"user_name": user_name},
+            limit=n_results,
+            include=["metadatas"]
         )
         
-        # Reconstruct ExtractedMemory from results
-        preferences = []
-        emotional_patterns = []
-        facts = []
+        metadatas = [m for m in (results or {}).get('metadatas') or [] if m]
+        try:
+            return list(map(from_metadata, metadatas))
+        except (KeyError, ValueError):
+            pass
         
-        if results and results.get('metadatas'):
-            for metadata, doc in zip(results['metadatas'], results.get('documents', [])):
-                if not metadata:
-                    continue
-                    
-                data_str = metadata.get('data', '{}')
-                try:
-                    data = json.loads(data_str)
-                    mem_type = metadata.get('type', '')
-                    
-                    if mem_type == 'preference':
-                        preferences.append(UserPreference(**data))
-                    elif mem_type == 'emotional_pattern':
-                        emotional_patterns.append(EmotionalPattern(**data))
-                    elif mem_type == 'fact':
-                        facts.append(Fact(**data))
-                except (json.JSONDecodeError, KeyError) as e:
-                    print(f"Error parsing memory data: {e}")
-                    continue
-        
-        return ExtractedMemory(
-            preferences=preferences,
-            emotional_patterns=emotional_patterns,
-            facts=facts
-        )
+        # Rebuild record by record so one bad record doesn't drop the rest
+        items = []
+        for metadata in metadatas:
+            try:
+                items.append(from_metadata(metadata))
+            except (KeyError, ValueError) as e:
+                print(f"Error parsing memory data: {e}")
+        return items
     
     def merge_memories(
         self,
@@ -192,49 +484,46 @@ class VectorMemoryStore:
             Merged ExtractedMemory
         """
         # Merge preferences (avoid duplicates based on category and preference)
-        existing_prefs = {(p.category, p.preference.lower()) for p in existing.preferences}
         merged_prefs = existing.preferences.copy()
+        pref_index = _index_by_merge_key(merged_prefs)
         for pref in new.preferences:
-            key = (pref.category, pref.preference.lower())
-            if key not in existing_prefs:
+            key = pref.merge_key
+            idx = pref_index.get(key)
+            if idx is None:
+                pref_index[key] = len(merged_prefs)
                 merged_prefs.append(pref)
-            else:
+            elif pref.confidence > merged_prefs[idx].confidence:
                 # Update confidence if new one is higher
-                for i, ep in enumerate(merged_prefs):
-                    if (ep.category, ep.preference.lower()) == key:
-                        if pref.confidence > ep.confidence:
-                            merged_prefs[i] = pref
-                        break
+                merged_prefs[idx] = pref
         
         # Merge emotional patterns (avoid duplicates based on emotion and context)
-        existing_emotions = {(e.emotion.lower(), e.context.lower()) for e in existing.emotional_patterns}
         merged_emotions = existing.emotional_patterns.copy()
+        emotion_index = _index_by_merge_key(merged_emotions)
         for emotion in new.emotional_patterns:
-            key = (emotion.emotion.lower(), emotion.context.lower())
-            if key not in existing_emotions:
+            key = emotion.merge_key
+            idx = emotion_index.get(key)
+            if idx is None:
+                emotion_index[key] = len(merged_emotions)
                 merged_emotions.append(emotion)
             else:
                 # Update frequency
-                for i, ee in enumerate(merged_emotions):
-                    if (ee.emotion.lower(), ee.context.lower()) == key:
-                        merged_emotions[i].frequency += emotion.frequency
-                        break
+                merged_emotions[idx].frequency += emotion.frequency
         
         # Merge facts (avoid duplicates based on fact text)
-        existing_facts = {f.fact.lower() for f in existing.facts}
         merged_facts = existing.facts.copy()
+        fact_index = _index_by_merge_key(merged_facts)
         for fact in new.facts:
-            if fact.fact.lower() not in existing_facts:
+            key = fact.merge_key
+            idx = fact_index.get(key)
+            if idx is None:
+                fact_index[key] = len(merged_facts)
                 merged_facts.append(fact)
-            else:
+            elif fact.importance > merged_facts[idx].importance:
                 # Update importance if new one is higher
-                for i, ef in enumerate(merged_facts):
-                    if ef.fact.lower() == fact.fact.lower():
-                        if fact.importance > ef.importance:
-                            merged_facts[i] = fact
-                        break
+                merged_facts[idx] = fact
         
-        return ExtractedMemory(
+        # Items are already validated, so skip re-validation
+        return ExtractedMemory.model_construct(
             preferences=merged_prefs,
             emotional_patterns=merged_emotions,
             facts=merged_facts
@@ -247,8 +536,10 @@ class VectorMemoryStore:
         Args:
             user_name: Name of the user
         """
-        # Get all IDs for this user
-        results = self.collection.get(where={"user_name": user_name})
-        if results and results.get('ids'):
-            self.collection.delete(ids=results['ids'])
+        # Write queued records first so none of them survive the delete
+        self.flush()
+        
+        # Let ChromaDB apply the filter instead of fetching every id first
+        for collection in self._collections.values():
+            collection.delete(where={"user_name": user_name})
 
@@ -49,7 +49,7 @@ async function sendMessage() {
     sendBtn.textContent = 'Thinking...';
 
     try {
-        const response = await fetch(`${API_BASE}/chat`, {
+        const response = await fetch(`${API_BASE}/chat/stream`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
@@ -59,17 +59,31 @@ async function sendMessage() {
             })
         });
 
-        const data = await response.json();
-        
-        // Add assistant response
-        addMessageToChat('assistant', data.response, currentPersonality);
-        messages.push({ role: 'assistant', content: data.response });
-
-        // Update memory display
-        if (data.memory) {
-            currentMemory = data.memory;
-            updateMemoryDisplay(data.memory);
+        if (!response.ok) {
+            throw new Error(`Request failed with status ${response.status}`);
         }
+
+        // Add assistant response and fill it in as chunks arrive
+        const contentDiv = addMessageToChat('assistant', '', currentPersonality);
+        const container = document.getElementById('chatContainer');
+        let reply = '';
+
+        await readEventStream(response, (event, data) => {
+            if (event === 'memory') {
+                // Update memory display
+                currentMemory = data;
+                updateMemoryDisplay(data);
+            } else if (event === 'error') {
+                // The reply streamed, but extracting or storing memory failed
+                addMessageToChat('assistant', `Memory update failed: ${data.detail}`, 'error');
+            } else if (event === 'message') {
+                reply += data.text;
+                contentDiv.textContent = reply;
+                container.scrollTop = container.scrollHeight;
+            }
+        });
+
+        messages.push({ role: 'assistant', content: reply });
     } catch (error) {
         addMessageToChat('assistant', `Error: ${error.message}`, 'error');
     } finally {
@@ -78,6 +92,33 @@ async function sendMessage() {
     }
 }
 
+async function readEventStream(response, onEvent) {
+    // Minimal server-sent events reader for streamed fetch responses
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
 function addMessageToChat(role, content, label = '') {
     const container = document.getElementById('chatContainer');
     const messageDiv = document.createElement('div');
@@ -96,6 +137,7 @@ function addMessageToChat(role, content, label = '') {
     
     container.appendChild(messageDiv);
     container.scrollTop = container.scrollHeight;
+    return contentDiv;
 }
 
 function updateMemoryDisplay(memory) {
@@ -0,0 +1,89 @@
+"""
+Tests for VectorMemoryStore.bulk_store chunking
+"""
+
+import pytest # type: ignore
+
+from src.vector_memory import VectorMemoryStore
+from src.memory_extractor import ExtractedMemory, UserPreference, Fact
+
+
+class RecordingCollection:
+    """Stands in for a ChromaDB collection, recording the ids of each write"""
+
+    def __init__(self):
+        self.ids = []
+
+    def upsert(self, documents, metadatas, ids):
+        self.ids.extend(ids)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = VectorMemoryStore(persist_directory=str(tmp_path))
+    store._collections = {mem_type: RecordingCollection() for mem_type in store._collections}
+
+    # Record how many records each chunk written by bulk_store holds
+    store.chunk_sizes = []
+    write = store._write
+
+    def recording_write(batches):
+        store.chunk_sizes.append(sum(len(records) for batch in batches for records in batch.values()))
+        write(batches)
+
+    store._write = recording_write
+    return store
+
+
+def make_memory(n_preferences: int, n_facts: int) -> ExtractedMemory:
+    return ExtractedMemory(
+        preferences=[
+            UserPreference(category="music", preference=f"genre {i}", confidence=0.5)
+            for i in range(n_preferences)
+        ],
+        emotional_patterns=[],
+        facts=[
+            Fact(fact=f"fact {i}", category="life", importance=0.5, context="")
+            for i in range(n_facts)
+        ]
+    )
+
+
+def test_bulk_store_splits_memories_across_chunks(store):
+    # 3 records per memory never fill a chunk of 4 evenly
+    memories = [("alice", make_memory(2, 1)) for _ in range(5)]
+
+    written = store.bulk_store(memories, batch_size=4)
+
+    assert written == 15
+    assert store.chunk_sizes == [4, 4, 4, 3]
+    assert len(store._collections["preference"].ids) == 10
+    assert len(store._collections["fact"].ids) == 5
+
+
+def test_bulk_store_splits_a_memory_larger_than_batch_size(store):
+    written = store.bulk_store([("alice", make_memory(7, 3))], batch_size=4)
+
+    assert written == 10
+    assert store.chunk_sizes == [4, 4, 2]
+
+
+def test_bulk_store_reports_progress_per_memory(store):
+    seen = []
+
+    store.bulk_store(
+        [("alice", make_memory(1, 1)) for _ in range(3)],
+        batch_size=2,
+        progress=seen.append
+    )
+
+    assert seen == [1, 2, 3]
+    assert store.chunk_sizes == [2, 2, 2]
+
+
+def test_bulk_store_handles_empty_input(store):
+    seen = []
+
+    assert store.bulk_store([], progress=seen.append) == 0
+    assert seen == []
+    assert store.chunk_sizes == []